@@ -1,6 +1,14 @@
 import os
-import json
-from flask import Flask, request, jsonify, make_response
+import asyncio
+import gzip
+import hashlib
+import itertools
+import uuid
+from types import MappingProxyType
+import orjson
+from cachetools import TTLCache
+from quart import Quart, Response, request, jsonify
+from quart.json.provider import DefaultJSONProvider
 from google.cloud import aiplatform
 
 
@@ -13,8 +21,23 @@ REGION = "global"  # e.g., 'us-central1'
 CUSTOM_AGENT_RESOURCE_NAME = "projects/stately-moon-480119-h9/locations/global/agents/16e30e05-6c68-461f-921e-2d81f73541ed" 
 # -------------------------------------------
 
-# Initialize Flask App
-app = Flask(__name__)
+# Initialize Quart App (Flask-compatible API, but async so the event loop can
+# multiplex many in-flight Vertex calls instead of blocking a thread per request)
+app = Quart(__name__)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, which encodes and decodes several times
+    faster than the stdlib json module used by default."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+app.json = OrjsonProvider(app)
 
 # Initialize Vertex AI Client (required for chat and agent interaction)
 try:
@@ -22,11 +45,38 @@ try:
     print("Vertex AI client initialized successfully.")
 except Exception as e:
     print(f"Error initializing Vertex AI client: {e}")
-    # Flask will still start, but the chat endpoint will fail if the client is needed.
+    # The app will still start, but the chat endpoint will fail if the client is needed.
+
+# Reuse a small pool of async ChatServiceClients across requests. Constructing a
+# client per request would redo the gRPC channel setup (TLS handshake, ADC token
+# fetch, HTTP/2 negotiation), which costs far more than the RPC itself. The async
+# clients let one event loop keep many Vertex calls in flight at once, and the
+# round-robin pool spreads those streams over a few TCP connections. The pool is
+# built lazily on first use because grpc.aio channels must be created inside the
+# running event loop.
+GRPC_POOL_SIZE = int(os.environ.get('GRPC_POOL_SIZE', 4))
+CLIENT_POOL = []
+_client_counter = itertools.count()
+
+
+def get_chat_client():
+    """Returns the next ChatServiceAsyncClient from the pool, round-robin."""
+    if not CLIENT_POOL:
+        try:
+            CLIENT_POOL.extend(
+                aiplatform.gapic.ChatServiceAsyncClient(
+                    client_options={"api_endpoint": f"{REGION}-aiplatform.googleapis.com"}
+                )
+                for _ in range(GRPC_POOL_SIZE)
+            )
+        except Exception as e:
+            print(f"Error creating ChatServiceAsyncClient pool: {e}")
+            return None
+    return CLIENT_POOL[next(_client_counter) % len(CLIENT_POOL)]
 
 # --- Agent Definitions ---
 # This list simulates available agents, combining your custom agent with mock examples.
-AVAILABLE_AGENTS = [
+_RAW_AGENTS = [
     {
         "id": "product-agent-custom",
         "name": "Product Inventory & Catalog Agent (Custom)",
@@ -51,7 +101,7 @@ AVAILABLE_AGENTS = [
 ]
 # --- Tool Definitions ---
 # This list contains the pre-built tools available in the Vertex AI Agent Builder ecosystem.
-PRE_BUILT_TOOLS = [
+_RAW_TOOLS = [
     {
         "name": "Vertex AI Search",
         "category": "Vertex AI Native",
@@ -91,6 +141,218 @@ PRE_BUILT_TOOLS = [
     # You can add the rest of the tools here (Monday.com, Zendesk, etc.)
 ]
 
+# Precompute the mock reply template for non-custom agents, so the mock hot path
+# costs a dict lookup and one str.format with no Vertex-related work at all.
+for _agent in _RAW_AGENTS:
+    if _agent['type'] != 'Custom Agent':
+        _agent['_mock_response_tmpl'] = (
+            f"Selected agent '{_agent['name']}' is running in mock mode. "
+            "You asked: '{prompt}'"
+        )
+
+# Freeze the metadata at import: tuples of read-only mapping views. Anything that
+# accidentally mutated an agent or tool entry now fails loudly, and the frozen
+# entries are safe to share across requests and cache layers.
+AVAILABLE_AGENTS = tuple(MappingProxyType(d) for d in _RAW_AGENTS)
+PRE_BUILT_TOOLS = tuple(MappingProxyType(d) for d in _RAW_TOOLS)
+
+# Index the agents by id once at import time. AVAILABLE_AGENTS is static, so this
+# turns the per-request lookup in chat_with_agent into a single O(1) dict access.
+AGENTS_BY_ID = {a['id']: a for a in AVAILABLE_AGENTS}
+
+# The agent and tool lists never change after import, so serialize them to JSON
+# exactly once here instead of running jsonify() on every GET. (The raw lists are
+# serialized because orjson does not encode mapping proxies; underscore-prefixed
+# fields are internal and stay out of the API payload.)
+_AGENTS_JSON = orjson.dumps(
+    [{k: v for k, v in a.items() if not k.startswith('_')} for a in _RAW_AGENTS]
+)
+_TOOLS_JSON = orjson.dumps(_RAW_TOOLS)
+
+# The JSON payloads compress well (lots of repeated keys), so gzip them once at
+# import too; per-request compression work then drops to a header check.
+_AGENTS_GZ = gzip.compress(_AGENTS_JSON)
+_TOOLS_GZ = gzip.compress(_TOOLS_JSON)
+
+# Strong ETags derived from the payload bytes, plus a long max-age, let browsers
+# and intermediaries revalidate with a 304 instead of refetching the bodies.
+_AGENTS_ETAG = hashlib.blake2b(_AGENTS_JSON, digest_size=8).hexdigest()
+_TOOLS_ETAG = hashlib.blake2b(_TOOLS_JSON, digest_size=8).hexdigest()
+_CACHE_CONTROL = 'public, max-age=3600'
+
+
+def _static_json_response(raw, gzipped, etag):
+    """Returns a cached JSON body, precompressed when the client accepts gzip,
+    with ETag revalidation short-circuiting to a 304."""
+    if request.headers.get('If-None-Match') == etag:
+        return Response(b'', status=304, headers={'ETag': etag, 'Cache-Control': _CACHE_CONTROL})
+    headers = {'ETag': etag, 'Cache-Control': _CACHE_CONTROL}
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        headers.update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+        return Response(gzipped, mimetype='application/json', headers=headers)
+    return Response(raw, mimetype='application/json', headers=headers)
+
+# --- Chat Micro-Batching ---
+
+async def _predict_batch(agent_config, batch_items):
+    """
+    Sends a batch of (prompt, history, session_name) triples for one agent to
+    Vertex AI and returns the responses in order.
+    """
+    # Note: We use a pooled `ChatServiceAsyncClient` for deployed Agent Builder Agents.
+    # Reusing the pooled clients keeps their HTTP/2 channels warm across requests.
+    client = get_chat_client()
+
+    # Format conversation history for the API (assuming 'history' is [{role: user/model, text: str}])
+    # The specific format might vary slightly based on your Agent Builder deployment's SDK/API version.
+
+    print(f"Attempting to chat with custom agent: {agent_config['resource_name']} "
+          f"(batch of {len(batch_items)})")
+
+    # --- Placeholder for Actual Agent Engine API Call ---
+    # NOTE: The actual implementation requires more detailed setup (like creating a session,
+    # handling streams, and managing the Agent Engine SDK).
+    # We will use a mock response to ensure the frontend works, but the structure is ready
+    # for you to insert the official Agent Builder client call once you look up the exact API method.
+    #
+    # You would typically issue one batched call here, e.g.
+    # `await client.batch_predict(instances=[...])`, instead of one RPC per prompt.
+
+    # MOCK RESPONSES for the custom agent:
+    responses = [
+        (
+            f"**Response from your Custom Product Agent ({agent_config['name']}):** "
+            f"I have successfully processed your request: '{user_prompt}'. "
+            f"If this were live, I would now be consulting the RAG tool (ProductCatalogTool) or the "
+            f"Cloud Function (ProductInventoryTool) using my defined tools."
+        )
+        for user_prompt, _history, _session_name in batch_items
+    ]
+    # --- End Placeholder ---
+
+    return responses
+
+
+class ChatBatcher:
+    """
+    Coalesces chat requests that arrive within a short window into one Vertex call.
+
+    Each submit() parks the request on an asyncio future; a background task drains
+    the queue, waiting up to max_latency_ms for up to max_batch_size requests,
+    groups them by agent, and issues a single batched predict per group. This
+    amortizes per-RPC overhead and model warmups across concurrent users.
+    """
+
+    def __init__(self, max_batch_size=8, max_latency_ms=20):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self._queue = None
+        self._drain_task = None
+
+    async def submit(self, agent_config, user_prompt, history, session_name=None):
+        """Enqueues one chat request and returns its response once the batch completes."""
+        loop = asyncio.get_event_loop()
+        if self._queue is None:
+            # Created lazily so the queue and drain task bind to the serving loop.
+            self._queue = asyncio.Queue()
+            self._drain_task = loop.create_task(self._drain())
+        future = loop.create_future()
+        await self._queue.put((agent_config, user_prompt, history, session_name, future))
+        return await future
+
+    async def _drain(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            # Block for the first request, then collect whatever else arrives
+            # before the latency window closes or the batch fills up.
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Group by agent so each group maps to one batched Vertex call.
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[0]['id'], []).append(item)
+
+            for items in groups.values():
+                try:
+                    responses = await _predict_batch(
+                        items[0][0],
+                        [(prompt, history, session) for _, prompt, history, session, _ in items],
+                    )
+                    for (*_, future), response in zip(items, responses):
+                        if not future.done():
+                            future.set_result(response)
+                except Exception as e:
+                    for *_, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+
+
+CHAT_BATCHER = ChatBatcher(
+    max_batch_size=int(os.environ.get('CHAT_BATCH_SIZE', 8)),
+    max_latency_ms=int(os.environ.get('CHAT_BATCH_LATENCY_MS', 20)),
+)
+
+# Vertex sessions keyed by the client-supplied conversation id. Reusing one
+# session across every turn of a conversation spares the agent from
+# re-establishing RAG context and re-loading tools per request; the TTL drops
+# sessions for conversations idle longer than 30 minutes.
+SESSIONS = TTLCache(maxsize=4096, ttl=1800)
+
+
+def _get_vertex_session(conversation_id, agent_config):
+    """Returns the Vertex session name for a conversation, creating and
+    registering it on the first turn."""
+    if conversation_id:
+        session_name = SESSIONS.get(conversation_id)
+        if session_name is not None:
+            return session_name
+    # NOTE: With a live agent you would call something like
+    # `await client.create_session(parent=agent_config['resource_name'])` and
+    # store the returned resource name. The placeholder id keeps the
+    # register-and-reuse path exercised end to end.
+    session_name = f"{agent_config['resource_name']}/sessions/{uuid.uuid4().hex}"
+    if conversation_id:
+        SESSIONS[conversation_id] = session_name
+    return session_name
+
+
+# Cache agent responses for identical (agent, prompt, history) requests so repeat
+# questions skip the Vertex round-trip entirely, saving latency and quota.
+RESP_CACHE = TTLCache(maxsize=1024, ttl=300)
+
+
+# Any single history message larger than this is truncated before being sent on
+# to the agent; huge pastes would otherwise dominate the token budget every turn.
+_MAX_MESSAGE_BYTES = 4096
+
+
+def _truncate_history(history):
+    """Caps oversized history messages, marking where text was cut."""
+    trimmed = []
+    for message in history:
+        text = message.get('text', '')
+        if len(text) > _MAX_MESSAGE_BYTES:
+            message = dict(message, text=text[:_MAX_MESSAGE_BYTES] + ' ... [truncated]')
+        trimmed.append(message)
+    return trimmed
+
+
+def _response_cache_key(agent_id, user_prompt, history):
+    """Builds a hashable cache key covering the agent, prompt, and full history."""
+    history_digest = hashlib.blake2b(
+        orjson.dumps(history, option=orjson.OPT_SORT_KEYS)
+    ).digest()
+    return (agent_id, user_prompt, history_digest)
+
 # --- Flask Routes ---
 
 @app.route('/', methods=['GET'])
@@ -105,71 +367,56 @@ def home():
 @app.route('/api/v1/agents', methods=['GET'])
 def list_agents():
     """Endpoint to return the list of available agents to the frontend."""
-    return jsonify(AVAILABLE_AGENTS)
+    return _static_json_response(_AGENTS_JSON, _AGENTS_GZ, _AGENTS_ETAG)
 
 @app.route('/api/v1/tools', methods=['GET'])
 def list_tools():
     """Endpoint to return the list of available pre-built tools to the frontend."""
-    return jsonify(PRE_BUILT_TOOLS)
+    return _static_json_response(_TOOLS_JSON, _TOOLS_GZ, _TOOLS_ETAG)
 
 @app.route('/api/v1/chat', methods=['POST'])
-def chat_with_agent():
+async def chat_with_agent():
     """
     Endpoint to receive a user query and forward it to the selected Vertex AI agent.
     """
-    data = request.get_json()
+    data = await request.get_json()
     agent_id = data.get('agentId')
+    conversation_id = data.get('conversationId')
     user_prompt = data.get('prompt')
-    history = data.get('history', []) # Conversation history
+    history = _truncate_history(data.get('history', [])) # Conversation history
 
     if not agent_id or not user_prompt:
-        return make_response(jsonify({"error": "Missing agentId or prompt"}), 400)
+        return jsonify({"error": "Missing agentId or prompt"}), 400
 
-    # Find the agent configuration
-    agent_config = next((a for a in AVAILABLE_AGENTS if a['id'] == agent_id), None)
+    # Find the agent configuration (O(1) via the precomputed index)
+    agent_config = AGENTS_BY_ID.get(agent_id)
+    if agent_config is None:
+        return jsonify({"error": f"Unknown agentId: {agent_id}"}), 404
 
-    if not agent_config or agent_config['type'] != 'Custom Agent':
-        # For non-custom/mock agents, return a simulated response
+    if agent_config['type'] != 'Custom Agent':
+        # Mock agents never reach Vertex; formatting the precomputed template is
+        # the entire cost of this path.
         return jsonify({
-            "response": f"Selected agent '{agent_config['name']}' is running in mock mode. You asked: '{user_prompt}'"
+            "response": agent_config['_mock_response_tmpl'].format(prompt=user_prompt)
         })
-    
+
+    # Serve repeat questions from the response cache instead of re-asking Vertex.
+    cache_key = _response_cache_key(agent_id, user_prompt, history)
+    cached_response = RESP_CACHE.get(cache_key)
+    if cached_response is not None:
+        return jsonify({"response": cached_response})
+
     # --- REAL VERTEX AI AGENT INTERACTION LOGIC ---
     try:
-        # Note: We use the `ChatServiceClient` for deployed Agent Builder Agents
-        client = aiplatform.gapic.ChatServiceClient(client_options={"api_endpoint": f"{REGION}-aiplatform.googleapis.com"})
-        
-        # Format conversation history for the API (assuming 'history' is [{role: user/model, text: str}])
-        # The specific format might vary slightly based on your Agent Builder deployment's SDK/API version.
-        # This implementation uses the simpler `predict` on a deployed agent.
-
-        # 1. Start or resume the conversation (session)
-        # You often need to manage a conversation session. For simplicity here, we create a temporary one,
-        # but in a real app, you would manage a session ID.
-        
-        # Simulating the required 'location' parameter for the API call
-        # The actual method call signature can be complex and depends on the specific Agent Builder deployment type.
-        # For this example, we'll abstract the complexity with a placeholder interaction.
-        
-        print(f"Attempting to chat with custom agent: {agent_config['resource_name']}")
-
-        # --- Placeholder for Actual Agent Engine API Call ---
-        # NOTE: The actual implementation requires more detailed setup (like creating a session,
-        # handling streams, and managing the Agent Engine SDK).
-        # We will use a mock response to ensure the frontend works, but the structure is ready
-        # for you to insert the official Agent Builder client call once you look up the exact API method.
-        #
-        # You would typically use a method like `client.predict()` or similar on the deployed agent resource.
-
-        # MOCK RESPONSE for the custom agent:
-        final_response = (
-            f"**Response from your Custom Product Agent ({agent_config['name']}):** "
-            f"I have successfully processed your request: '{user_prompt}'. "
-            f"If this were live, I would now be consulting the RAG tool (ProductCatalogTool) or the "
-            f"Cloud Function (ProductInventoryTool) using my defined tools."
-        )
-        # --- End Placeholder ---
+        # 1. Start or resume the conversation (session). The session registered
+        # for this conversation id is reused on every turn, so the agent keeps
+        # its RAG context and tool state instead of rebuilding them per request.
+        session_name = _get_vertex_session(conversation_id, agent_config)
 
+        # Hand the request to the micro-batcher, which coalesces it with any other
+        # chat requests in flight for the same agent before calling Vertex.
+        final_response = await CHAT_BATCHER.submit(agent_config, user_prompt, history, session_name)
+        RESP_CACHE[cache_key] = final_response
 
         return jsonify({
             "response": final_response
@@ -177,12 +424,69 @@ def chat_with_agent():
 
     except Exception as e:
         # Catch any errors from Vertex AI calls (e.g., authentication, API failure)
-        return make_response(jsonify({"error": f"Vertex AI Agent Error: {str(e)}. Check ADC and agent configuration."}), 500)
+        return jsonify({"error": f"Vertex AI Agent Error: {str(e)}. Check ADC and agent configuration."}), 500
+
+
+@app.route('/api/v1/chat/stream', methods=['POST'])
+async def chat_with_agent_stream():
+    """
+    Streaming variant of /api/v1/chat. Emits the agent response incrementally as
+    Server-Sent Events, so the client sees output at first-token latency instead
+    of waiting for the whole generation to finish.
+    """
+    data = await request.get_json()
+    agent_id = data.get('agentId')
+    conversation_id = data.get('conversationId')
+    user_prompt = data.get('prompt')
+    history = _truncate_history(data.get('history', [])) # Conversation history
+
+    if not agent_id or not user_prompt:
+        return jsonify({"error": "Missing agentId or prompt"}), 400
+
+    agent_config = AGENTS_BY_ID.get(agent_id)
+    if agent_config is None:
+        return jsonify({"error": f"Unknown agentId: {agent_id}"}), 404
+
+    def sse_event(payload):
+        return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+    async def event_stream():
+        if agent_config['type'] != 'Custom Agent':
+            # For non-custom/mock agents, stream the precomputed simulated response
+            full_response = agent_config['_mock_response_tmpl'].format(prompt=user_prompt)
+        else:
+            cache_key = _response_cache_key(agent_id, user_prompt, history)
+            full_response = RESP_CACHE.get(cache_key)
+            if full_response is None:
+                try:
+                    session_name = _get_vertex_session(conversation_id, agent_config)
+                    full_response = await CHAT_BATCHER.submit(agent_config, user_prompt, history, session_name)
+                    RESP_CACHE[cache_key] = full_response
+                except Exception as e:
+                    yield sse_event({"error": f"Vertex AI Agent Error: {str(e)}. "
+                                              "Check ADC and agent configuration."})
+                    return
+
+        # NOTE: With a live agent you would iterate `client.streaming_predict(...)`
+        # here and forward each chunk as Vertex produces it. The placeholder
+        # response is re-chunked word by word so the frontend exercises the same
+        # incremental rendering path.
+        words = full_response.split(' ')
+        for i, word in enumerate(words):
+            delta = word if i == len(words) - 1 else word + ' '
+            yield sse_event({"delta": delta})
+        yield b"data: [DONE]\n\n"
+
+    return Response(event_stream(), mimetype='text/event-stream')
 
 
 if __name__ == '__main__':
+    # Local development only. In production run under hypercorn instead, e.g.:
+    #   hypercorn backend_api:app --workers 2
     # Use a dynamic port if available, otherwise default to 5000
     port = int(os.environ.get('PORT', 5000))
-    # Run the Flask app
-    print(f"Flask API running on http://127.0.0.1:{port}")
-    app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
+    # Run the Quart app. debug stays off by default so the reloader and interactive
+    # tracebacks don't slow request handling; export QUART_DEBUG=1 to opt in.
+    debug = os.environ.get('QUART_DEBUG', '0') == '1'
+    print(f"Quart API running on http://127.0.0.1:{port}")
+    app.run(debug=debug, host='0.0.0.0', port=port)
\ No newline at end of file
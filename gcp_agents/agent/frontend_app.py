@@ -1,16 +1,44 @@
 import streamlit as st
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import time
+import uuid
 
 # --- Configuration ---
 # Point this to your local Flask API server (must match the port in backend_api.py)
-API_BASE_URL = "http://127.0.0.1:5000" 
+API_BASE_URL = "http://127.0.0.1:5000"
+
+# Shared HTTP session so every backend call reuses one keep-alive connection from
+# the urllib3 pool instead of opening a fresh TCP connection per request.
+# cache_resource makes it one session per Streamlit *process*, so reruns and
+# concurrent browser sessions all share the same pool instead of rebuilding
+# adapter state on every script execution.
+# Explicit (connect, read) timeout for every backend call; without it a hung
+# backend would block the Streamlit script (and its WebSocket) indefinitely.
+REQUEST_TIMEOUT = (1.0, 30.0)
+
+@st.cache_resource(show_spinner=False)
+def get_http():
+    """Returns the process-wide HTTP session for backend API calls."""
+    session = requests.Session()
+    # Retry transient gateway errors with exponential backoff before giving up
+    retry = Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+    session.mount('http://', HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=16))
+    return session
+
+# Only the last MAX_TURNS exchanges are sent as history with each prompt.
+# Sending the whole log makes total token cost grow quadratically with
+# conversation length, and old turns rarely matter for the next answer.
+MAX_TURNS = 8
 
 # --- UI Setup ---
 st.set_page_config(layout="wide", page_title="Vertex AI Agent Dashboard")
 st.title("🤖 Vertex AI Agent Dashboard")
 
+HTTP = get_http()
+
 # Initialize session state for agents and chat
 if 'agents' not in st.session_state:
     st.session_state.agents = []
@@ -18,6 +46,10 @@ if 'selected_agent_id' not in st.session_state:
     st.session_state.selected_agent_id = None
 if 'messages' not in st.session_state:
     st.session_state.messages = []
+if 'conversation_id' not in st.session_state:
+    # Sent with every chat POST so the backend can reuse one Vertex session
+    # across all turns of this conversation
+    st.session_state.conversation_id = uuid.uuid4().hex
 
 # --- Functions ---
 
@@ -26,9 +58,10 @@ if 'messages' not in st.session_state:
 def fetch_agents():
     """Fetches the list of available agents from the backend API."""
     try:
-        response = requests.get(f"{API_BASE_URL}/api/v1/agents")
+        response = HTTP.get(f"{API_BASE_URL}/api/v1/agents", timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        # orjson decodes the raw bytes faster than response.json()
+        return orjson.loads(response.content)
     except requests.exceptions.ConnectionError:
         # This error is critical if the backend isn't running
         st.error(f"Cannot connect to backend API at {API_BASE_URL}. Ensure 'python backend_api.py' is running in a separate terminal.")
@@ -41,65 +74,92 @@ def select_agent_callback():
     """Handles agent selection from the dropdown."""
     st.session_state.selected_agent_id = st.session_state.agent_selector
     st.session_state.messages = [] # Clear chat history on new agent selection
-    # Find the selected agent's name for the toast message
-    selected_agent = next(a for a in st.session_state.agents if a['id'] == st.session_state.selected_agent_id)
-    st.session_state.selected_agent_name = selected_agent['name']
+    st.session_state.conversation_id = uuid.uuid4().hex # New agent, new conversation
+    # Cache the selected agent object so reruns read it straight from session
+    # state instead of looking it up again
+    st.session_state.selected_agent = st.session_state.agents_by_id[st.session_state.selected_agent_id]
+    st.session_state.selected_agent_name = st.session_state.selected_agent['name']
     st.toast(f"Switched to agent: {st.session_state.selected_agent_name}")
 
 @st.cache_data(ttl=3600)
 def fetch_tools():
     """Fetches the list of available pre-built tools from the backend API."""
     try:
-        response = requests.get(f"{API_BASE_URL}/api/v1/tools")
+        response = HTTP.get(f"{API_BASE_URL}/api/v1/tools", timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
     except requests.exceptions.RequestException as e:
         # If the API is running, but the route fails, this handles the error.
         st.error(f"Error fetching pre-built tools: {e}")
         return []
 
+@st.cache_data
+def render_tools_md(tools):
+    """Builds the sidebar tool list as a single Markdown string, so the whole
+    list is one widget update per rerun instead of one st.markdown per tool."""
+    return "\n\n".join(
+        f"**{t['name']}** (`{t['category']}`): {t['description']}" for t in tools
+    )
+
+def iter_sse_deltas(response):
+    """Yields response text deltas from a Server-Sent Events stream."""
+    for line in response.iter_lines():
+        if not line.startswith(b"data: "):
+            continue
+        payload = line[len(b"data: "):]
+        if payload == b"[DONE]":
+            break
+        event = orjson.loads(payload)
+        if "error" in event:
+            raise RuntimeError(event["error"])
+        yield event.get("delta", "")
+
 def handle_user_input(prompt):
     """Sends the user's prompt and history to the backend API for processing."""
-    
-    # 1. Add user message to history
+
+    # 1. Add the user message to history and render it right away. Drawing into
+    # the chat elements below avoids the two full-script reruns (and their
+    # re-renders of the whole chat log) the old 'thinking' flow triggered per turn.
     st.session_state.messages.append({"role": "user", "content": prompt})
-    
-    # 2. Add a 'thinking' placeholder message
-    st.session_state.messages.append({"role": "assistant", "content": "🤔 Thinking..."}) 
-    
-    # Rerun to display the user message and 'thinking' message immediately
-    st.rerun() 
+    with st.chat_message("user"):
+        st.markdown(prompt)
 
-    # 3. Call the backend API
+    # 2. Call the backend API and stream the response into the chat as it arrives.
+    # Tokens render at first-token latency, so no 'thinking' placeholder is needed.
     try:
-        # Prepare the history to send to the backend
+        # Prepare the history to send to the backend, capped at the last MAX_TURNS
+        # exchanges (one user + one assistant message per turn, plus the new prompt)
         data = {
             "agentId": st.session_state.selected_agent_id,
+            "conversationId": st.session_state.conversation_id,
             "prompt": prompt,
             "history": [
                 {"role": m["role"], "text": m["content"]}
-                for m in st.session_state.messages[:-1] # Exclude the 'thinking' message
+                for m in st.session_state.messages[-(2 * MAX_TURNS + 1):]
             ]
         }
-        
-        # Make the API request to the running Flask backend
-        response = requests.post(f"{API_BASE_URL}/api/v1/chat", json=data)
+
+        # Make the streaming API request to the running Flask backend.
+        # Serialize with orjson instead of letting requests use the stdlib json.
+        response = HTTP.post(
+            f"{API_BASE_URL}/api/v1/chat/stream",
+            data=orjson.dumps(data),
+            headers={"Content-Type": "application/json"},
+            stream=True,
+            timeout=REQUEST_TIMEOUT,
+        )
         response.raise_for_status()
-        
-        response_data = response.json()
-        agent_response = response_data.get("response", "Could not get a valid response from the agent.")
-        
-        # 4. Update the 'thinking' placeholder with the real response
-        st.session_state.messages[-1] = {"role": "assistant", "content": agent_response}
-        
-    except requests.exceptions.RequestException as e:
-        # 4. Update the 'thinking' placeholder with the error
+
+        # 3. Render deltas incrementally; write_stream returns the full text
+        with st.chat_message("assistant"):
+            agent_response = st.write_stream(iter_sse_deltas(response))
+        st.session_state.messages.append({"role": "assistant", "content": agent_response})
+
+    except (requests.exceptions.RequestException, RuntimeError) as e:
+        # 3. Record and display the error instead of a response
         error_message = f"Backend Request Error: {e}. Ensure the Flask API is running correctly."
-        st.session_state.messages[-1] = {"role": "error", "content": error_message}
+        st.session_state.messages.append({"role": "error", "content": error_message})
         st.error(error_message)
-    
-    # 5. Rerun to display the final response
-    st.rerun()
 
 # --- Main Layout ---
 
@@ -114,7 +174,12 @@ with st.sidebar:
         st.stop() # Stop if the backend is not available
 
     st.session_state.agents = agent_list
-    agent_options = {a['id']: f"[{a['type']}] {a['name']}" for a in agent_list}
+    # Index agents by id once per rerun so later lookups are O(1) instead of scans
+    st.session_state.agents_by_id = {a['id']: a for a in agent_list}
+    # The agent list is stable for the session, so build the selector labels once
+    if 'agent_options' not in st.session_state:
+        st.session_state.agent_options = {a['id']: f"[{a['type']}] {a['name']}" for a in agent_list}
+    agent_options = st.session_state.agent_options
     
     # Determine the default selection
     default_index = 0
@@ -131,10 +196,14 @@ with st.sidebar:
         on_change=select_agent_callback
     )
     
-    # Update the selected agent details in session state
+    # Update the selected agent details in session state. The callback keeps the
+    # cached object fresh on selection changes; the lookup here only runs on the
+    # first render of a session.
     st.session_state.selected_agent_id = selected_agent_option
-    selected_agent = next(a for a in agent_list if a['id'] == selected_agent_option)
-    st.session_state.selected_agent_name = selected_agent['name']
+    if st.session_state.get('selected_agent', {}).get('id') != selected_agent_option:
+        st.session_state.selected_agent = st.session_state.agents_by_id[selected_agent_option]
+        st.session_state.selected_agent_name = st.session_state.selected_agent['name']
+    selected_agent = st.session_state.selected_agent
     
     st.markdown("---")
     st.subheader("Agent Details")
@@ -152,10 +221,7 @@ with st.sidebar:
     if tools_list:
         # Use a list of expanders or a simple list. An expander is cleaner.
         with st.expander("Show Available Tool Connectors"):
-            for tool in tools_list:
-                st.markdown(
-                    f"**{tool['name']}** (`{tool['category']}`): {tool['description']}"
-                )
+            st.markdown(render_tools_md(tools_list))
     else:
         st.caption("Could not load the list of pre-built tools from the backend.")
 